@@ -1,15 +1,35 @@
 # =============== IMPORTING REQUIRED LIBRARIES ===================
 
-from flask import Flask, render_template, redirect, session, request, url_for, flash
+from flask import Flask, render_template, redirect, session, request, url_for, flash, g, jsonify, abort
+from flask import Response, stream_with_context, send_file
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
 import time 
+import queue
+import threading
+import secrets
+from itsdangerous import URLSafeSerializer, BadSignature
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.orm import joinedload
 import json
+import sys
+import csv
+import io
+import gzip
+import hashlib
+import click
 from datetime import datetime, timedelta
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from functools import wraps, lru_cache
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 
 # =================== DONE =======================================
 
@@ -48,6 +68,27 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 # Create upload folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# -------------------- ARCHIVE CONFIG --------------------------
+# Old QuizAttempt rows are moved into gzipped JSON-lines files, one per month
+ARCHIVE_FOLDER = os.environ.get('ARCHIVE_FOLDER', os.path.join(app.instance_path, 'archive'))
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', 365))
+
+# -------------------- EXPORT CONFIG --------------------------
+EXPORT_FOLDER = os.environ.get('EXPORT_FOLDER', os.path.join(app.instance_path, 'exports'))
+EXPORT_BATCH_SIZE = 1000
+
+# -------------------- ROSTER IMPORT CONFIG --------------------------
+ROSTER_COLUMNS = ('username', 'password', 'fullname', 'dob')
+ROSTER_CHUNK_SIZE = 500
+ROSTER_POOL_THRESHOLD = 20  # smaller rosters are hashed inline, a pool costs more to start
+IMPORT_FOLDER = os.environ.get('IMPORT_FOLDER', os.path.join(app.instance_path, 'imports'))
+
+# -------------------- TEMPLATE CACHING --------------------------
+# Compiled templates are kept on disk so new gunicorn workers skip Jinja compilation
+JINJA_CACHE_DIR = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -74,6 +115,360 @@ def admin_required(f):
     return decorated_function
 
 
+# -------------------- ADMISSION CONTROL --------------------------
+# Limits are per worker process. With sync workers (one request at a time) nothing is ever
+# queued; the Procfile runs gthread workers so several heavy requests can be in flight.
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 4))
+ADMISSION_MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', 200))
+ADMISSION_TICKET_TTL = 30  # seconds a ticket survives without being polled
+ADMISSION_TICKET_MAX_AGE = 900  # older tickets are treated as new arrivals
+ADMISSION_MAX_WAIT_CREDIT = 600  # most waiting-room time added back to a running exam
+ADMISSION_POLL_SECONDS = 2
+# Quiz submissions carry answers that cannot be re-sent, so they are counted but never shed
+ADMISSION_NEVER_SHED = {'take_quiz'}
+
+class AdmissionController:
+    """Caps concurrent heavy requests and keeps a FIFO waiting room for the overflow"""
+
+    def __init__(self, max_in_flight, max_queue):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = {}  # ticket -> [enqueued_at, last_seen, polled_seconds]
+        self.consumed = {}  # ticket -> admitted_at; a ticket is good for one admission only
+        self.expired = {}  # ticket -> expired_at; an abandoned ticket cannot rejoin at its old place
+        self.stats = {'admitted': 0, 'queued': 0, 'shed': 0, 'waits': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    def _expire(self, now):
+        for ticket in [t for t, (_, seen, _) in self.waiting.items() if now - seen > ADMISSION_TICKET_TTL]:
+            del self.waiting[ticket]
+            self.expired[ticket] = now
+        for done in (self.consumed, self.expired):
+            for ticket in [t for t, at in done.items() if now - at > ADMISSION_TICKET_MAX_AGE]:
+                del done[ticket]
+
+    def _position(self, ticket):
+        enqueued_at = self.waiting[ticket][0]
+        return sum(1 for t, (at, _, _) in self.waiting.items() if (at, t) < (enqueued_at, ticket)) + 1
+
+    def _adopt(self, ticket, enqueued_at, now):
+        # Tickets issued by another worker join this queue at their original place, but only
+        # time spent polling here is credited: gaps never exceed the TTL, or the ticket expired
+        if ticket not in self.waiting:
+            self.waiting[ticket] = [enqueued_at, now, 0.0]
+        entry = self.waiting[ticket]
+        entry[2] += now - entry[1]
+        entry[1] = now
+
+    def _retired(self, ticket):
+        return ticket in self.consumed or ticket in self.expired
+
+    def try_admit(self, ticket=None, enqueued_at=None):
+        """Return ('admitted', waited, used_ticket), ('queued', ticket, position) or ('shed',)"""
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            free = self.max_in_flight - self.in_flight
+
+            # A ticket that was already used or abandoned is treated as a brand-new arrival
+            if self._retired(ticket):
+                ticket = None
+
+            if ticket:
+                self._adopt(ticket, enqueued_at, now)
+                position = self._position(ticket)
+                if position <= free:
+                    waited = min(self.waiting.pop(ticket)[2], ADMISSION_MAX_WAIT_CREDIT)
+                    self.consumed[ticket] = now
+                    return self._admit(waited, ticket)
+                return ('queued', ticket, position)
+
+            if free > 0 and not self.waiting:
+                return self._admit(0)
+
+            if len(self.waiting) >= self.max_queue:
+                self.stats['shed'] += 1
+                return ('shed',)
+
+            ticket = f"{now:.6f}-{secrets.token_hex(4)}"
+            self.waiting[ticket] = [now, now, 0.0]
+            self.stats['queued'] += 1
+            return ('queued', ticket, self._position(ticket))
+
+    def _admit(self, waited, ticket=None):
+        self.in_flight += 1
+        self.stats['admitted'] += 1
+        if waited:
+            self.stats['waits'] += 1
+            self.stats['wait_total'] += waited
+            self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+        return ('admitted', waited, ticket)
+
+    def enter(self):
+        """Count a request that must never be queued or shed (a quiz submission)"""
+        with self.lock:
+            self.in_flight += 1
+            self.stats['admitted'] += 1
+
+    def try_enter(self):
+        """Take a slot only if one is free; for requests that cannot wait in the queue"""
+        with self.lock:
+            if self.in_flight >= self.max_in_flight:
+                self.stats['shed'] += 1
+                return False
+            self.in_flight += 1
+            self.stats['admitted'] += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def status(self, ticket, enqueued_at):
+        """Poll result for a waiting ticket without consuming a slot"""
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            if ticket in self.consumed:
+                return 'used', 0
+            if ticket in self.expired:
+                return 'expired', 0
+            self._adopt(ticket, enqueued_at, now)
+            position = self._position(ticket)
+            ready = position <= self.max_in_flight - self.in_flight
+            return ('ready' if ready else 'waiting'), position
+
+    def metrics(self):
+        with self.lock:
+            waits = self.stats['waits']
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queue_depth': len(self.waiting),
+                'max_queue': self.max_queue,
+                'admitted_total': self.stats['admitted'],
+                'queued_total': self.stats['queued'],
+                'shed_total': self.stats['shed'],
+                'wait_seconds_avg': round(self.stats['wait_total'] / waits, 3) if waits else 0,
+                'wait_seconds_max': round(self.stats['wait_max'], 3),
+            }
+
+admission = AdmissionController(ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE)
+ticket_signer = URLSafeSerializer(app.secret_key, salt='admission-ticket')
+
+def read_ticket(signed):
+    """Return (ticket, enqueued_at) from a signed ticket, or (None, None) if missing/forged"""
+    try:
+        ticket = ticket_signer.loads(signed or '')
+        enqueued_at = float(ticket.split('-', 1)[0])
+    except (BadSignature, ValueError, AttributeError):
+        return None, None
+    if time.time() - enqueued_at > ADMISSION_TICKET_MAX_AGE:
+        return None, None
+    return ticket, enqueued_at
+
+def shed_response():
+    return render_template('waiting_room.html', shed=True,
+                           retry_after=ADMISSION_POLL_SECONDS * 5), 503, \
+        {'Retry-After': str(ADMISSION_POLL_SECONDS * 5)}
+
+def admission_controlled(f):
+    """Decorator to cap concurrent heavy requests; overflow GETs wait in the waiting room"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Form submissions cannot be queued (the form data would be lost): over the cap they
+        # are shed, e.g. a login POST, except submissions that must always get through
+        if request.method != 'GET':
+            if not admission.try_enter():
+                if request.endpoint not in ADMISSION_NEVER_SHED:
+                    return shed_response()
+                admission.enter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission.release()
+
+        # Redeem the pass left by an admitted ticket: the wait is credited exactly once. The
+        # slot was released for the redirect, so it is taken again only if one is free;
+        # otherwise the student queues again and the pass is kept.
+        admission_pass = session.get('admission_pass')
+        if admission_pass and admission_pass['path'] == request.path and 'ticket' not in request.args \
+                and admission.try_enter():
+            session.pop('admission_pass')
+            g.admission_wait = admission_pass['wait']
+            try:
+                return f(*args, **kwargs)
+            finally:
+                admission.release()
+
+        ticket, enqueued_at = read_ticket(request.args.get('ticket'))
+        used = session.get('admission_used', [])
+        if ticket in used:
+            ticket, enqueued_at = None, None
+        decision = admission.try_admit(ticket, enqueued_at)
+
+        if decision[0] == 'shed':
+            return shed_response()
+
+        if decision[0] == 'queued':
+            signed = ticket_signer.dumps(decision[1])
+            args = dict(kwargs, ticket=signed)
+            return render_template(
+                'waiting_room.html',
+                shed=False,
+                position=decision[2],
+                target_url=url_for(request.endpoint, **args),
+                status_url=url_for('waiting_room_status', ticket=signed),
+                poll_seconds=ADMISSION_POLL_SECONDS
+            ), 503, {'Retry-After': str(ADMISSION_POLL_SECONDS)}
+
+        if decision[2]:
+            # Burn the ticket and drop it from the URL, so reloading cannot claim the wait again
+            admission.release()
+            session['admission_used'] = (used + [decision[2]])[-5:]
+            earlier = admission_pass['wait'] if admission_pass and admission_pass['path'] == request.path else 0
+            session['admission_pass'] = {'path': request.path,
+                                         'wait': min(earlier + int(decision[1]), ADMISSION_MAX_WAIT_CREDIT)}
+            return redirect(url_for(request.endpoint, **kwargs))
+
+        try:
+            return f(*args, **kwargs)
+        finally:
+            admission.release()
+    return decorated_function
+
+
+# -------------------- LIVE LEADERBOARD --------------------------
+LEADERBOARD_SIZE = 10
+LEADERBOARD_RESYNC_SECONDS = 10  # catches submissions handled by other workers
+LEADERBOARD_HEARTBEAT_SECONDS = 15
+LEADERBOARD_SUBSCRIBER_BUFFER = 100
+# Every open stream holds a worker thread (gthread), so cap them well below --threads;
+# browsers turned away fall back to polling LEADERBOARD_POLL_SECONDS apart
+LEADERBOARD_MAX_STREAMS = int(os.environ.get('LEADERBOARD_MAX_STREAMS', 4))
+LEADERBOARD_POLL_SECONDS = 15
+
+def leaderboard_rank_key(entry):
+    return (-(entry["score"] or 0), entry["timestamp"], entry["attempt_id"])
+
+class LeaderboardHub:
+    """In-process pub/sub: one aggregator thread keeps each watched ranking and fans out deltas"""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.channel = queue.Queue()
+        self.boards = {}       # (quiz_id, chapter_id) -> entries, best first
+        self.subscribers = {}  # (quiz_id, chapter_id) -> {subscriber queue: is_proctor}
+        self.polled = {}       # (quiz_id, chapter_id) -> (loaded_at, entries) for polling clients
+        self.streams = threading.BoundedSemaphore(LEADERBOARD_MAX_STREAMS)
+        self.thread = None
+
+    def publish(self, key, entry):
+        """Announce a committed attempt; cheap, and a no-op when nobody watches this board"""
+        if key in self.boards:
+            self.channel.put((key, entry))
+
+    def subscribe(self, key, load, proctor=False):
+        """Register a watcher; load() builds the ranking from the database on first use.
+
+        Only proctors get 'submission' events: they name every submitter and score, while
+        students may see no more than the top of the ranking.
+        """
+        if key not in self.boards:
+            entries = load()
+            with self.lock:
+                self.boards.setdefault(key, entries)
+
+        subscriber = queue.Queue(maxsize=LEADERBOARD_SUBSCRIBER_BUFFER)
+        with self.lock:
+            self.subscribers.setdefault(key, {})[subscriber] = proctor
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            return subscriber, list(self.boards[key])
+
+    def unsubscribe(self, key, subscriber):
+        with self.lock:
+            watchers = self.subscribers.get(key, {})
+            watchers.pop(subscriber, None)
+            if not watchers:
+                self.subscribers.pop(key, None)
+                self.boards.pop(key, None)
+
+    def board(self, key):
+        with self.lock:
+            entries = self.boards.get(key)
+            return list(entries) if entries is not None else None
+
+    def poll(self, key, load):
+        """Ranking for polling clients: the live board if watched, else a copy at most one poll old"""
+        entries = self.board(key)
+        if entries is not None:
+            return entries
+
+        now = time.monotonic()
+        with self.lock:
+            loaded_at, entries = self.polled.get(key, (0, None))
+        if entries is None or now - loaded_at >= LEADERBOARD_POLL_SECONDS:
+            entries = load()
+            with self.lock:
+                self.polled = {k: v for k, v in self.polled.items() if now - v[0] < LEADERBOARD_POLL_SECONDS}
+                self.polled[key] = (now, entries)
+        return list(entries)
+
+    def _run(self):
+        last_resync = time.monotonic()
+        while True:
+            try:
+                key, entry = self.channel.get(timeout=LEADERBOARD_RESYNC_SECONDS)
+                self._update(key, entry=entry)
+            except queue.Empty:
+                pass
+
+            if time.monotonic() - last_resync >= LEADERBOARD_RESYNC_SECONDS:
+                last_resync = time.monotonic()
+                with app.app_context():
+                    for key in list(self.boards):
+                        self._update(key, fresh=load_leaderboard(*key))
+                    db.session.remove()
+
+    def _update(self, key, entry=None, fresh=None):
+        with self.lock:
+            old = self.boards.get(key)
+            if old is None:
+                return
+            if fresh is None:
+                merged = [e for e in old if e["attempt_id"] != entry["attempt_id"]] + [entry]
+                fresh = sorted(merged, key=leaderboard_rank_key)[:self.size]
+            self.boards[key] = fresh
+            watchers = list(self.subscribers.get(key, {}).items())
+
+        changes = [dict(e, rank=i + 1) for i, e in enumerate(fresh)
+                   if i >= len(old) or old[i]["attempt_id"] != e["attempt_id"]]
+
+        events = []
+        if entry is not None:
+            events.append({"type": "submission", "entry": entry})
+        if changes or len(fresh) != len(old):
+            events.append({"type": "delta", "changes": changes, "size": len(fresh)})
+
+        for watcher, proctor in watchers:
+            for event in events:
+                if event["type"] == "submission" and not proctor:
+                    continue
+                try:
+                    watcher.put_nowait(event)
+                except queue.Full:
+                    # A watcher that fell behind skips ahead to the current ranking
+                    while not watcher.empty():
+                        watcher.get_nowait()
+                    watcher.put_nowait({"type": "snapshot", "entries": fresh})
+
+leaderboard_hub = LeaderboardHub(LEADERBOARD_SIZE)
+
+
 #----------------------------- MODELS (FIXED!) -----------------------------
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -119,20 +514,729 @@ class Question(db.Model):
     chapter = db.relationship('Chapter', backref='questions')
 
 class QuizAttempt(db.Model):
+    # AUTOINCREMENT so SQLite never hands out the id of an attempt that was archived
+    __table_args__ = (db.Index('ix_quiz_attempt_user_id_id', 'user_id', 'id'),
+                      {'sqlite_autoincrement': True})
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
     chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=True)
     score = db.Column(db.Integer, nullable=True)
     answers = db.Column(db.Text, nullable=True)
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('paper_snapshot.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='quiz_attempts')
     quiz = db.relationship('Quiz', backref='attempts')
     chapter = db.relationship('Chapter', backref='attempts')
 
+class ArchivedAttempt(db.Model):
+    """Index row for an attempt moved to the archive; the answers live in archive_file"""
+    __table_args__ = (db.Index('ix_archived_attempt_chapter_score', 'quiz_id', 'chapter_id', 'score'),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # original QuizAttempt id
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=True)
+    score = db.Column(db.Integer, nullable=True)
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('paper_snapshot.id'), nullable=True)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    archive_file = db.Column(db.String(100), nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    user = db.relationship('User')
+    quiz = db.relationship('Quiz')
+    chapter = db.relationship('Chapter')
+
+class UserMastery(db.Model):
+    """Compact per-user, per-chapter index of seen and wrongly answered question ids"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'chapter_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    seen = db.Column(db.LargeBinary, nullable=False, default=b'')       # packed uint32, sorted
+    incorrect = db.Column(db.LargeBinary, nullable=False, default=b'')  # packed uint32, oldest mistake first
+    unseen = db.Column(db.LargeBinary, nullable=True, default=b'')      # packed uint32, practice order
+    # Paper version incorrect/unseen were last pruned against; picks need no filtering while it is current
+    snapshot_id = db.Column(db.Integer, db.ForeignKey('paper_snapshot.id'), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    quiz = db.relationship('Quiz')
+    chapter = db.relationship('Chapter')
+
+class PaperSnapshot(db.Model):
+    """Immutable, versioned copy of a chapter's (or whole quiz's) questions"""
+    # AUTOINCREMENT so SQLite never reuses ids that may still sit in the snapshot cache
+    __table_args__ = (db.Index('ix_paper_snapshot_quiz_chapter', 'quiz_id', 'chapter_id', 'version'),
+                      {'sqlite_autoincrement': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=True)
+    version = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class UserChapterStats(db.Model):
+    """Per-user, per-chapter summary kept up to date at submit time"""
+    __table_args__ = (db.UniqueConstraint('user_id', 'chapter_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapter.id'), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    best_accuracy = db.Column(db.Float, nullable=False, default=0)
+    accuracy_sum = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    quiz = db.relationship('Quiz')
+    chapter = db.relationship('Chapter')
+
+    @property
+    def average_accuracy(self):
+        return round(self.accuracy_sum / self.attempts, 2) if self.attempts else 0
+
+
+# -------------------- HELPERS --------------------------
+ATTEMPTS_PER_PAGE = 20
+
+def accuracy_percent(correct, total):
+    return round((correct / total) * 100, 2) if total else 0
+
+def record_attempt_stats(user_id, quiz_id, chapter_id, score, total):
+    """Fold one submitted attempt into the user's chapter summary (caller commits)"""
+    accuracy = accuracy_percent(score, total)
+
+    # Increment in SQL so concurrent submissions cannot overwrite each other
+    summary = UserChapterStats.query.filter_by(user_id=user_id, chapter_id=chapter_id)
+    increment = {
+        'attempts': UserChapterStats.attempts + 1,
+        'accuracy_sum': UserChapterStats.accuracy_sum + accuracy,
+        'best_accuracy': db.case((UserChapterStats.best_accuracy < accuracy, accuracy),
+                                 else_=UserChapterStats.best_accuracy),
+        'updated_at': datetime.utcnow()
+    }
+    if summary.update(increment, synchronize_session=False):
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(UserChapterStats(user_id=user_id, quiz_id=quiz_id, chapter_id=chapter_id,
+                                            attempts=1, best_accuracy=accuracy, accuracy_sum=accuracy))
+    except IntegrityError:
+        # A concurrent first submission (e.g. a double-clicked submit) created the row meanwhile
+        summary.update(increment, synchronize_session=False)
+
+def fold_attempt_rows(summary, rows, counts):
+    """Accumulate (user_id, quiz_id, chapter_id, score) rows into UserChapterStats objects"""
+    for user_id, quiz_id, chapter_id, score in rows:
+        accuracy = accuracy_percent(score or 0, counts.get(chapter_id, 0))
+        stats = summary.get((user_id, chapter_id))
+        if not stats:
+            stats = summary[(user_id, chapter_id)] = UserChapterStats(
+                user_id=user_id, quiz_id=quiz_id, chapter_id=chapter_id,
+                attempts=0, best_accuracy=0, accuracy_sum=0)
+        stats.attempts += 1
+        stats.accuracy_sum += accuracy
+        stats.best_accuracy = max(stats.best_accuracy, accuracy)
+
+def rebuild_chapter_stats():
+    """Recompute every UserChapterStats row from the attempt history; returns the row count"""
+    UserChapterStats.query.delete()
+    counts = chapter_question_counts([cid for (cid,) in db.session.query(Chapter.id)])
+
+    # Archived attempts still count towards the summaries
+    summary = {}
+    for model in (ArchivedAttempt, QuizAttempt):
+        rows = db.session.query(
+            model.user_id, model.quiz_id, model.chapter_id, model.score
+        ).filter(model.chapter_id.isnot(None)).order_by(model.id).yield_per(1000)
+        fold_attempt_rows(summary, rows, counts)
+
+    db.session.add_all(summary.values())
+    db.session.commit()
+    return len(summary)
+
+# -------------------- PAPER SNAPSHOTS --------------------------
+SNAPSHOT_FIELDS = (
+    'id', 'question_statement', 'question_image',
+    'option_1', 'option_2', 'option_3', 'option_4',
+    'correct_option', 'explanation'
+)
+
+def question_to_dict(question):
+    return {field: getattr(question, field) for field in SNAPSHOT_FIELDS}
+
+def latest_snapshot(quiz_id, chapter_id=None):
+    """Return (id, version, content_hash) of the newest snapshot, without its payload"""
+    return db.session.query(
+        PaperSnapshot.id, PaperSnapshot.version, PaperSnapshot.content_hash
+    ).filter_by(quiz_id=quiz_id, chapter_id=chapter_id).order_by(PaperSnapshot.version.desc()).first()
+
+def publish_snapshot(quiz_id, chapter_id=None):
+    """Snapshot the live questions, adding a new version only if the content changed (caller commits)"""
+    if chapter_id:
+        questions = Question.query.filter_by(chapter_id=chapter_id)
+    else:
+        questions = Question.query.filter_by(quiz_id=quiz_id)
 
+    payload = json.dumps([question_to_dict(q) for q in questions.order_by(Question.id)],
+                         separators=(',', ':'), ensure_ascii=False)
+    content_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    latest = latest_snapshot(quiz_id, chapter_id)
+    if latest and latest.content_hash == content_hash:
+        return latest.id
+
+    snapshot = PaperSnapshot(
+        quiz_id=quiz_id,
+        chapter_id=chapter_id,
+        version=latest.version + 1 if latest else 1,
+        content_hash=content_hash,
+        payload=payload
+    )
+    db.session.add(snapshot)
+    db.session.flush()
+    return snapshot.id
+
+def current_snapshot_id(quiz_id, chapter_id=None):
+    """Id of the snapshot new exams are served from, publishing the first one on demand"""
+    latest = latest_snapshot(quiz_id, chapter_id)
+    if latest:
+        return latest.id
+    snapshot_id = publish_snapshot(quiz_id, chapter_id)
+    db.session.commit()
+    return snapshot_id
+
+def refresh_snapshots(quiz_id, chapter_id=None):
+    """Publish new versions after questions change (caller commits)"""
+    if chapter_id:
+        publish_snapshot(quiz_id, chapter_id)
+    if latest_snapshot(quiz_id) is not None:
+        publish_snapshot(quiz_id)
+
+@lru_cache(maxsize=256)
+def snapshot_questions(snapshot_id):
+    """Decoded questions of a snapshot; snapshots never change, so this is cached per process"""
+    payload = db.session.query(PaperSnapshot.payload).filter_by(id=snapshot_id).scalar()
+    return tuple(json.loads(payload)) if payload else ()
+
+def snapshot_size(snapshot_id):
+    """Number of questions an attempt on this snapshot was graded out of"""
+    return len(snapshot_questions(snapshot_id))
+
+@lru_cache(maxsize=128)
+def render_question_list(snapshot_id):
+    """Question-list markup of a snapshot; identical for every student, so rendered once per version"""
+    return Markup(render_template('take_quiz_questions.html', questions=snapshot_questions(snapshot_id)))
+
+# -------------------- MASTERY INDEX --------------------------
+PRACTICE_SIZE = 10
+
+def pack_ids(ids):
+    packed = array('I', ids)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+def packed_count(blob):
+    return len(blob or b'') // array('I').itemsize
+
+def unpack_ids(blob):
+    ids = array('I')
+    ids.frombytes(blob or b'')
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+def head_ids(blob, k):
+    """First k packed ids, decoding only those"""
+    return unpack_ids((blob or b'')[:k * array('I').itemsize])
+
+def record_mastery(user_id, quiz_id, chapter_id, results, snapshot_id):
+    """Merge {question_id: answered_correctly} into the user's index (caller commits)"""
+    # Lock the row (where the database supports it) so concurrent merges apply one after the other
+    mastery_query = UserMastery.query.filter_by(user_id=user_id, chapter_id=chapter_id).with_for_update()
+    mastery = mastery_query.first()
+    if not mastery:
+        try:
+            with db.session.begin_nested():
+                mastery = UserMastery(user_id=user_id, quiz_id=quiz_id, chapter_id=chapter_id,
+                                      seen=b'', incorrect=b'')
+                db.session.add(mastery)
+        except IntegrityError:
+            # A concurrent first submission created the row meanwhile; merge into that one
+            mastery = mastery_query.first()
+
+    seen, wrong = merge_mastery(set(unpack_ids(mastery.seen)), list(unpack_ids(mastery.incorrect)), results)
+    mastery.seen = pack_ids(sorted(seen))
+    mastery.incorrect = pack_ids(wrong)
+    refresh_candidates(mastery, snapshot_id)
+    return mastery
+
+def refresh_candidates(mastery, snapshot_id):
+    """Drop ids no longer on the paper and rebuild the unseen list for it (caller commits)"""
+    by_id = snapshot_question_map(snapshot_id)
+    seen = [qid for qid in unpack_ids(mastery.seen) if qid in by_id]
+    seen_set = set(seen)
+    mastery.seen = pack_ids(seen)
+    mastery.incorrect = pack_ids(qid for qid in unpack_ids(mastery.incorrect) if qid in by_id)
+    mastery.unseen = pack_ids(qid for qid in by_id if qid not in seen_set)
+    mastery.snapshot_id = snapshot_id
+
+def merge_mastery(seen, wrong, results):
+    """Apply one round of results: correct answers leave the wrong list, new mistakes join its end"""
+    seen.update(results)
+    wrong = [qid for qid in wrong if results.get(qid) is not True]
+    wrong_set = set(wrong)
+    wrong.extend(qid for qid, correct in results.items() if not correct and qid not in wrong_set)
+    return seen, wrong
+
+@lru_cache(maxsize=256)
+def snapshot_question_map(snapshot_id):
+    return {q["id"]: q for q in snapshot_questions(snapshot_id)}
+
+def rebuild_mastery_index():
+    """Recompute every UserMastery row from stored attempt answers; returns the row count"""
+    UserMastery.query.delete()
+    live_answers = dict(db.session.query(Question.id, Question.correct_option))
+
+    rows = db.session.query(
+        QuizAttempt.user_id, QuizAttempt.quiz_id, QuizAttempt.chapter_id, QuizAttempt.snapshot_id, QuizAttempt.answers
+    ).filter(QuizAttempt.chapter_id.isnot(None)).order_by(QuizAttempt.id).yield_per(1000)
+
+    index = {}
+    for user_id, quiz_id, chapter_id, snapshot_id, answers in rows:
+        try:
+            answers = {int(k): v for k, v in json.loads(answers or '{}').items()}
+        except json.JSONDecodeError:
+            continue
+
+        if snapshot_id:
+            key = {qid: q["correct_option"] for qid, q in snapshot_question_map(snapshot_id).items()}
+        else:
+            key = live_answers
+        results = {qid: selected is not None and selected == key.get(qid) for qid, selected in answers.items()}
+
+        entry = index.setdefault((user_id, chapter_id), [quiz_id, set(), []])
+        entry[1], entry[2] = merge_mastery(entry[1], entry[2], results)
+
+    db.session.add_all(
+        UserMastery(user_id=user_id, quiz_id=quiz_id, chapter_id=chapter_id,
+                    seen=pack_ids(sorted(seen)), incorrect=pack_ids(wrong))
+        for (user_id, chapter_id), (quiz_id, seen, wrong) in index.items()
+    )
+    db.session.commit()
+    return len(index)
+
+def select_practice_questions(mastery, snapshot_id, k=PRACTICE_SIZE):
+    """Pick up to k questions: past mistakes first, then questions never seen.
+
+    Both lists are kept pruned to the paper, so a pick decodes only their first k ids.
+    A row last pruned against another version is refreshed first (caller commits).
+    """
+    if mastery is None:
+        return list(snapshot_questions(snapshot_id)[:k])
+    if mastery.snapshot_id != snapshot_id:
+        refresh_candidates(mastery, snapshot_id)
+
+    by_id = snapshot_question_map(snapshot_id)
+    picked = [by_id[qid] for qid in head_ids(mastery.incorrect, k)]
+    picked += [by_id[qid] for qid in head_ids(mastery.unseen, k - len(picked))]
+    return picked
+
+# -------------------- ATTEMPT ARCHIVE --------------------------
+def archive_file_name(timestamp):
+    return f"attempts-{timestamp:%Y-%m}.jsonl.gz"
+
+def attempt_to_record(attempt):
+    # "id" first so readers can skip non-matching lines without parsing them
+    return {
+        "id": attempt.id,
+        "user_id": attempt.user_id,
+        "quiz_id": attempt.quiz_id,
+        "chapter_id": attempt.chapter_id,
+        "score": attempt.score,
+        "answers": attempt.answers,
+        "snapshot_id": attempt.snapshot_id,
+        "timestamp": attempt.timestamp.isoformat()
+    }
+
+def read_archived_record(archive_file, attempt_id):
+    """Stream an archive file and return the record of one attempt, or None"""
+    path = os.path.join(ARCHIVE_FOLDER, archive_file)
+    if not os.path.exists(path):
+        return None
+
+    prefix = f'{{"id":{attempt_id},'
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            if line.startswith(prefix):
+                return json.loads(line)
+    return None
+
+def load_archived_attempt(attempt_id):
+    """Fetch an archived attempt on demand, shaped like a QuizAttempt for the answer key"""
+    archived = ArchivedAttempt.query.get(attempt_id)
+    if not archived:
+        return None
+    record = read_archived_record(archived.archive_file, attempt_id)
+    archived.answers = record["answers"] if record else None
+    return archived
+
+# -------------------- ROSTER IMPORT --------------------------
+def validate_roster(rows):
+    """Check roster rows like user_register() does; returns (valid_rows, errors)"""
+    valid, errors, seen = [], [], set()
+
+    for line, row in rows:
+        username = (row.get('username') or '').strip()
+        password = row.get('password') or ''
+        fullname = (row.get('fullname') or '').strip()
+        dob = (row.get('dob') or '').strip()
+
+        if not username or not password or not fullname or not dob:
+            errors.append((line, username, 'All fields are required'))
+            continue
+        if len(username) > 50 or len(fullname) > 50:
+            errors.append((line, username, 'Username and full name must be at most 50 characters'))
+            continue
+        if len(password) < 6:
+            errors.append((line, username, 'Password must be at least 6 characters long'))
+            continue
+        try:
+            dob = datetime.strptime(dob, "%Y-%m-%d").date()
+        except ValueError:
+            errors.append((line, username, 'Invalid date format (expected YYYY-MM-DD)'))
+            continue
+        if username in seen:
+            errors.append((line, username, 'Duplicate username in roster'))
+            continue
+
+        seen.add(username)
+        valid.append({'line': line, 'username': username, 'password': password, 'fullname': fullname, 'dob': dob})
+
+    # One batched lookup (chunked to respect bind-parameter limits) instead of a query per row
+    names = [r['username'] for r in valid]
+    existing = set()
+    for start in range(0, len(names), ROSTER_CHUNK_SIZE):
+        existing.update(name for (name,) in db.session.query(User.username).filter(
+            User.username.in_(names[start:start + ROSTER_CHUNK_SIZE])))
+
+    for r in valid:
+        if r['username'] in existing:
+            errors.append((r['line'], r['username'], 'Username already exists'))
+    return [r for r in valid if r['username'] not in existing], errors
+
+def roster_process_pool(workers=None):
+    # spawn, because forking a multi-threaded gunicorn worker is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+_shared_roster_pool = None
+_shared_roster_pool_lock = threading.Lock()
+
+def shared_roster_pool():
+    """One long-lived hashing pool per web worker, started on the first large import"""
+    global _shared_roster_pool
+    with _shared_roster_pool_lock:
+        if _shared_roster_pool is None:
+            _shared_roster_pool = roster_process_pool()
+        return _shared_roster_pool
+
+def hash_passwords(passwords, workers=None, pool=None):
+    """Hash passwords across a process pool; hashing is CPU-bound so threads would not help"""
+    if len(passwords) < ROSTER_POOL_THRESHOLD:
+        return [generate_password_hash(p) for p in passwords]
+
+    chunksize = max(1, len(passwords) // ((workers or os.cpu_count() or 1) * 4))
+    if pool is not None:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+    with roster_process_pool(workers) as pool:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+def import_roster(rows, workers=None, pool=None):
+    """Create users from (line_number, row_dict) pairs; returns a report with errors and throughput"""
+    started = time.perf_counter()
+    valid, errors = validate_roster(rows)
+
+    hash_started = time.perf_counter()
+    hashes = hash_passwords([r['password'] for r in valid], workers, pool)
+    hash_seconds = time.perf_counter() - hash_started
+
+    created = 0
+    for start in range(0, len(valid), ROSTER_CHUNK_SIZE):
+        chunk = valid[start:start + ROSTER_CHUNK_SIZE]
+        mappings = [
+            {'username': r['username'], 'password': h, 'fullname': r['fullname'], 'dob': r['dob']}
+            for r, h in zip(chunk, hashes[start:start + ROSTER_CHUNK_SIZE])
+        ]
+        try:
+            db.session.execute(db.insert(User), mappings)
+            db.session.commit()
+            created += len(chunk)
+        except IntegrityError:
+            # Someone registered one of these names meanwhile; retry the chunk row by row
+            db.session.rollback()
+            for r, mapping in zip(chunk, mappings):
+                try:
+                    db.session.execute(db.insert(User), [mapping])
+                    db.session.commit()
+                    created += 1
+                except IntegrityError:
+                    db.session.rollback()
+                    errors.append((r['line'], r['username'], 'Username already exists'))
+
+    seconds = time.perf_counter() - started
+    return {
+        'total': len(rows),
+        'created': created,
+        'errors': sorted(errors),
+        'seconds': round(seconds, 2),
+        'hash_seconds': round(hash_seconds, 2),
+        'users_per_second': round(created / seconds, 1) if seconds else created
+    }
+
+def read_roster(stream):
+    """Parse a roster CSV into (line_number, row) pairs; raises ValueError if columns are missing"""
+    reader = csv.DictReader(stream)
+    reader.fieldnames = [(name or '').strip().lower() for name in (reader.fieldnames or [])]
+    missing = [c for c in ROSTER_COLUMNS if c not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    return [(reader.line_num, row) for row in reader]
+
+def import_file_path(job_id, partial=False):
+    return os.path.join(IMPORT_FOLDER, f"{job_id}.json" + (".part" if partial else ""))
+
+def run_import_job(job_id, rows):
+    """Import a roster in the background; the report appears once the import is complete.
+
+    Rows (plaintext passwords included) are only held in memory, never written to disk.
+    """
+    global _shared_roster_pool
+    with app.app_context():
+        try:
+            try:
+                report = import_roster(rows, pool=shared_roster_pool())
+            except BrokenProcessPool:
+                # A hashing process died; start a fresh pool for this and later imports
+                with _shared_roster_pool_lock:
+                    _shared_roster_pool = None
+                report = import_roster(rows, pool=shared_roster_pool())
+            with open(import_file_path(job_id, partial=True), 'w', encoding='utf-8') as fh:
+                json.dump(report, fh)
+            os.replace(import_file_path(job_id, partial=True), import_file_path(job_id))
+        except Exception:
+            app.logger.exception("Roster import %s failed", job_id)
+            if os.path.exists(import_file_path(job_id, partial=True)):
+                os.remove(import_file_path(job_id, partial=True))
+        finally:
+            db.session.remove()
+
+# -------------------- ATTEMPT EXPORT --------------------------
+EXPORT_HEADER = ['Username', 'Full Name', 'DOB', 'Quiz', 'Chapter', 'Score', 'Total', 'Date']
+
+def parse_export_filters(args):
+    """Read quiz/chapter/date filters from request args; raises ValueError on bad dates"""
+    filters = {
+        'quiz_id': args.get('quiz_id', type=int),
+        'chapter_id': args.get('chapter_id', type=int),
+        'start': None,
+        'end': None
+    }
+    if args.get('start'):
+        filters['start'] = datetime.strptime(args['start'], "%Y-%m-%d")
+    if args.get('end'):
+        filters['end'] = datetime.strptime(args['end'], "%Y-%m-%d") + timedelta(days=1)
+    return filters
+
+def export_rows(filters):
+    """Yield one tuple per attempt (archived ones included) without materializing the result"""
+    chapter_counts = dict(db.session.query(Question.chapter_id, db.func.count(Question.id)).group_by(Question.chapter_id))
+    quiz_counts = dict(db.session.query(Question.quiz_id, db.func.count(Question.id)).group_by(Question.quiz_id))
+
+    for model in (ArchivedAttempt, QuizAttempt):
+        query = db.session.query(
+            User.username, User.fullname, User.dob, Quiz.title, Chapter.title,
+            model.quiz_id, model.chapter_id, model.score, model.snapshot_id, model.timestamp
+        ).join(User, User.id == model.user_id).join(Quiz, Quiz.id == model.quiz_id).outerjoin(
+            Chapter, Chapter.id == model.chapter_id
+        )
+        if filters['quiz_id']:
+            query = query.filter(model.quiz_id == filters['quiz_id'])
+        if filters['chapter_id']:
+            query = query.filter(model.chapter_id == filters['chapter_id'])
+        if filters['start']:
+            query = query.filter(model.timestamp >= filters['start'])
+        if filters['end']:
+            query = query.filter(model.timestamp < filters['end'])
+
+        # Server-side cursor on PostgreSQL; rows are fetched EXPORT_BATCH_SIZE at a time
+        query = query.order_by(model.id).execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+
+        for username, fullname, dob, quiz_title, chapter_title, quiz_id, chapter_id, score, snapshot_id, timestamp in query:
+            if snapshot_id:
+                total = snapshot_size(snapshot_id)
+            else:
+                total = chapter_counts.get(chapter_id, 0) if chapter_id else quiz_counts.get(quiz_id, 0)
+            yield (
+                username,
+                fullname,
+                dob.strftime("%Y-%m-%d"),
+                quiz_title,
+                chapter_title or "N/A",
+                score,
+                total,
+                timestamp.strftime("%Y-%m-%d %H:%M") if timestamp else "N/A"
+            )
+
+def export_csv_lines(filters, excel=False):
+    """Yield the export as CSV text, one line at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # The BOM makes Excel open the file as UTF-8
+    yield ('\ufeff' if excel else '') + ','.join(EXPORT_HEADER) + '\r\n'
+    for row in export_rows(filters):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+
+def export_file_path(job_id, partial=False):
+    return os.path.join(EXPORT_FOLDER, f"{job_id}.csv" + (".part" if partial else ""))
+
+def run_export_job(job_id, filters, excel):
+    """Write an export to disk in the background; the file appears once it is complete"""
+    with app.app_context():
+        try:
+            with open(export_file_path(job_id, partial=True), 'w', encoding='utf-8', newline='') as fh:
+                for line in export_csv_lines(filters, excel):
+                    fh.write(line)
+            os.replace(export_file_path(job_id, partial=True), export_file_path(job_id))
+        except Exception:
+            app.logger.exception("Attempt export %s failed", job_id)
+            if os.path.exists(export_file_path(job_id, partial=True)):
+                os.remove(export_file_path(job_id, partial=True))
+        finally:
+            db.session.remove()
+
+def month_start(value, offset=0):
+    month = value.year * 12 + value.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def leaderboard_entry(attempt_id, user_id, username, score, timestamp):
+    return {
+        "attempt_id": attempt_id,
+        "user_id": user_id,
+        "username": username,
+        "score": score,
+        "timestamp": timestamp.isoformat(),
+        "attempted_on": timestamp.strftime("%d %b %Y, %H:%M")
+    }
+
+def load_leaderboard(quiz_id, chapter_id):
+    """Top attempts of a chapter as plain dicts, best first (archived attempts included)"""
+    rows = []
+    for model in (QuizAttempt, ArchivedAttempt):
+        rows += db.session.query(
+            model.id, model.user_id, User.username, model.score, model.timestamp
+        ).join(User, User.id == model.user_id).filter(
+            model.quiz_id == quiz_id,
+            model.chapter_id == chapter_id
+        ).order_by(
+            model.score.desc(),
+            model.timestamp.asc()
+        ).limit(LEADERBOARD_SIZE).all()
+    rows.sort(key=lambda row: (-(row.score or 0), row.timestamp))
+    return [leaderboard_entry(*row) for row in rows[:LEADERBOARD_SIZE]]
+
+def chapter_question_counts(chapter_ids):
+    """Return {chapter_id: number of questions} using a single grouped query"""
+    if not chapter_ids:
+        return {}
+    rows = db.session.query(Question.chapter_id, db.func.count(Question.id)).filter(
+        Question.chapter_id.in_(chapter_ids)
+    ).group_by(Question.chapter_id).all()
+    return dict(rows)
+
+
+
+
+# -------------------- SCHEMA UPGRADES --------------------------
+def upgrade_schema():
+    """Create new tables and bring databases made by older versions up to date (idempotent)"""
+    existing_tables = set(db.inspect(db.engine).get_table_names())
+    db.create_all()
+
+    # create_all() never alters existing tables, so new columns/indexes are added here
+    add_missing_column(QuizAttempt.__table__.c.snapshot_id)
+    add_missing_column(UserMastery.__table__.c.unseen)
+    add_missing_column(UserMastery.__table__.c.snapshot_id)
+
+    with db.engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_quiz_attempt_user_id_id ON quiz_attempt (user_id, id)"))
+
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as conn:
+            sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'quiz_attempt'")).scalar()
+            if 'AUTOINCREMENT' not in sql.upper():
+                rebuild_sqlite_quiz_attempt(conn)
+
+    # Summary tables start out empty; fill them from the history the first time they appear
+    if 'user_chapter_stats' not in existing_tables:
+        backfill(rebuild_chapter_stats)
+    if 'user_mastery' not in existing_tables:
+        backfill(rebuild_mastery_index)
+
+def add_missing_column(column):
+    """ALTER TABLE ... ADD COLUMN for a nullable model column that older databases lack"""
+    table = column.table.name
+    if column.name in {c['name'] for c in db.inspect(db.engine).get_columns(table)}:
+        return
+
+    ddl = f"ALTER TABLE {table} ADD COLUMN {column.name} {column.type.compile(dialect=db.engine.dialect)}"
+    for fk in column.foreign_keys:
+        ddl += f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(ddl))
+    except (OperationalError, ProgrammingError):
+        # Another worker starting at the same time may have added it first
+        if column.name not in {c['name'] for c in db.inspect(db.engine).get_columns(table)}:
+            raise
+
+def backfill(rebuild):
+    try:
+        rebuild()
+    except IntegrityError:
+        # Another worker starting at the same time filled the table first
+        db.session.rollback()
+
+def rebuild_sqlite_quiz_attempt(conn):
+    """SQLite cannot add AUTOINCREMENT in place, so copy quiz_attempt into a new table"""
+    columns = ', '.join(f'"{c["name"]}"' for c in db.inspect(conn).get_columns('quiz_attempt'))
+    conn.execute(text("ALTER TABLE quiz_attempt RENAME TO quiz_attempt_old"))
+    conn.execute(text("DROP INDEX IF EXISTS ix_quiz_attempt_user_id_id"))
+    QuizAttempt.__table__.create(conn)
+    conn.execute(text(f"INSERT INTO quiz_attempt ({columns}) SELECT {columns} FROM quiz_attempt_old"))
+    conn.execute(text("DROP TABLE quiz_attempt_old"))
+
+    # Ids already reused before this upgrade aside, new ids start above every archived one
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'quiz_attempt'"))
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'quiz_attempt', MAX(m) FROM ("
+        "SELECT COALESCE(MAX(id), 0) AS m FROM quiz_attempt "
+        "UNION ALL SELECT COALESCE(MAX(id), 0) FROM archived_attempt)"
+    ))
+
+with app.app_context():
+    upgrade_schema()
 
 
 # ===================== ERROR HANDLERS ================================
@@ -197,6 +1301,7 @@ def user_register():
 
 # ---------------- USER LOGIN (SECURE!) ----------------
 @app.route('/user/login', methods=['GET', 'POST'])
+@admission_controlled
 def user_login():
 
     # 🔥 CLEAR OLD FLASH MESSAGES ON PAGE LOAD
@@ -356,30 +1461,56 @@ def contact():
 @login_required
 def user_dashboard():
     search_query = request.args.get('search', '').strip().lower()
-
-    chapters = Chapter.query.all()
+    before = request.args.get('before', type=int)
+    user_id = session['user_id']
 
     if search_query:
         quizzes = Quiz.query.filter(Quiz.title.ilike(f'%{search_query}%')).all()
     else:
         quizzes = Quiz.query.all()
 
-    attempts = QuizAttempt.query.filter_by(user_id=session['user_id']).order_by(QuizAttempt.timestamp.desc()).all()
-    
-    # Attach total questions to each attempt
+    # Keyset pagination: newest first, next page starts below the last id shown.
+    # Archived attempts keep their original ids, so both tables merge on id.
+    attempts = []
+    for model in (QuizAttempt, ArchivedAttempt):
+        attempts_query = model.query.filter_by(user_id=user_id).options(
+            joinedload(model.quiz), joinedload(model.chapter)
+        )
+        if before:
+            attempts_query = attempts_query.filter(model.id < before)
+        attempts += attempts_query.order_by(model.id.desc()).limit(ATTEMPTS_PER_PAGE + 1).all()
+    attempts.sort(key=lambda a: a.id, reverse=True)
+    attempts = attempts[:ATTEMPTS_PER_PAGE + 1]
+
+    next_before = None
+    if len(attempts) > ATTEMPTS_PER_PAGE:
+        attempts = attempts[:ATTEMPTS_PER_PAGE]
+        next_before = attempts[-1].id
+
+    # Attach total questions to each attempt: the size of the paper it was graded on, or the
+    # live count for attempts recorded before snapshots existed
+    counts = chapter_question_counts({a.chapter_id for a in attempts if a.chapter_id and not a.snapshot_id})
     for attempt in attempts:
-        if attempt.chapter:
-            attempt.total_questions = len(attempt.chapter.questions)
+        if attempt.snapshot_id:
+            attempt.total_questions = snapshot_size(attempt.snapshot_id)
         else:
-            attempt.total_questions = 0
+            attempt.total_questions = counts.get(attempt.chapter_id, 0)
+
+    chapter_stats = UserChapterStats.query.filter_by(user_id=user_id).options(
+        joinedload(UserChapterStats.quiz), joinedload(UserChapterStats.chapter)
+    ).order_by(UserChapterStats.updated_at.desc()).all()
+    total_attempts = sum(s.attempts for s in chapter_stats)
 
     return render_template(
         'user_dashboard.html', 
         username=session.get('username'),
         quizzes=quizzes, 
-        chapters=chapters, 
         search_query=search_query,
-        attempts=attempts
+        attempts=attempts,
+        next_before=next_before,
+        is_first_page=before is None,
+        chapter_stats=chapter_stats,
+        total_attempts=total_attempts
     )
 
 # ---------------- CHAPTER WISE QUIZ ----------------
@@ -406,13 +1537,10 @@ def leaderboard(quiz_id, chapter_id):
     quiz = Quiz.query.get_or_404(quiz_id)
     chapter = Chapter.query.get_or_404(chapter_id)
 
-    top_attempts = QuizAttempt.query.filter_by(
-        quiz_id=quiz_id,
-        chapter_id=chapter_id
-    ).order_by(
-        QuizAttempt.score.desc(),
-        QuizAttempt.timestamp.asc()
-    ).limit(10).all()
+    # Boards being watched live are kept in memory, so no query is needed for them
+    top_entries = leaderboard_hub.board((quiz.id, chapter.id))
+    if top_entries is None:
+        top_entries = load_leaderboard(quiz.id, chapter.id)
 
     current_user_id = session.get('user_id')
 
@@ -420,25 +1548,88 @@ def leaderboard(quiz_id, chapter_id):
         'leaderboard.html',
         quiz=quiz,
         chapter=chapter,
-        top_attempts=top_attempts,
-        current_user_id=current_user_id
+        top_entries=top_entries,
+        current_user_id=current_user_id,
+        poll_seconds=LEADERBOARD_POLL_SECONDS
     )
 
+def check_live_board(quiz_id, chapter_id):
+    """Live boards are open to students and admins, for chapters that exist in the quiz"""
+    if 'user_id' not in session and 'admin_id' not in session:
+        abort(403)
+    if not Chapter.query.filter_by(id=chapter_id, quiz_id=quiz_id).first():
+        abort(404)
+
+@app.route('/leaderboard/<int:quiz_id>/<int:chapter_id>/stream')
+def leaderboard_stream(quiz_id, chapter_id):
+    check_live_board(quiz_id, chapter_id)
+
+    # Refuse rather than queue: the page switches to polling when the stream is rejected
+    if not leaderboard_hub.streams.acquire(blocking=False):
+        return Response("Too many live viewers, poll /top instead", status=503,
+                        headers={'Retry-After': str(LEADERBOARD_POLL_SECONDS)})
+
+    key = (quiz_id, chapter_id)
+    try:
+        subscriber, entries = leaderboard_hub.subscribe(key, lambda: load_leaderboard(quiz_id, chapter_id),
+                                                        proctor='admin_id' in session)
+    except Exception:
+        leaderboard_hub.streams.release()
+        raise
+
+    def events():
+        yield f"event: snapshot\ndata: {json.dumps({'entries': entries})}\n\n"
+        while True:
+            try:
+                event = subscriber.get(timeout=LEADERBOARD_HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    def close():
+        leaderboard_hub.unsubscribe(key, subscriber)
+        leaderboard_hub.streams.release()
+
+    # call_on_close also runs when the client leaves before the generator ever started
+    response = Response(events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(close)
+    return response
+
+@app.route('/leaderboard/<int:quiz_id>/<int:chapter_id>/top')
+def leaderboard_top(quiz_id, chapter_id):
+    check_live_board(quiz_id, chapter_id)
+    entries = leaderboard_hub.poll((quiz_id, chapter_id), lambda: load_leaderboard(quiz_id, chapter_id))
+    return jsonify(entries=entries)
+
+# ---------------- PROCTOR LIVE VIEW ----------------
+@app.route('/admin/live/<int:quiz_id>/<int:chapter_id>')
+@admin_required
+def proctor_live(quiz_id, chapter_id):
+    quiz = Quiz.query.get_or_404(quiz_id)
+    chapter = Chapter.query.get_or_404(chapter_id)
+    return render_template('proctor_live.html', quiz=quiz, chapter=chapter, poll_seconds=LEADERBOARD_POLL_SECONDS)
+
 # ---------------- ANSWER KEY ----------------
 @app.route('/user/answer_key/<int:attempt_id>')
 @login_required
 def answer_key(attempt_id):
-    attempt = QuizAttempt.query.get_or_404(attempt_id)
+    attempt = QuizAttempt.query.get(attempt_id) or load_archived_attempt(attempt_id)
+    if not attempt:
+        abort(404)
 
     if attempt.user_id != session.get('user_id'):
         flash('You are not authorized to view this answer key.', 'danger')
         return redirect('/user/dashboard'), 403
 
-    # Load questions
-    if attempt.chapter_id:
-        questions_query = Question.query.filter_by(chapter_id=attempt.chapter_id).all()
+    # Grade against the paper the attempt was served; older attempts fall back to live questions
+    if attempt.snapshot_id:
+        questions_query = snapshot_questions(attempt.snapshot_id)
+    elif attempt.chapter_id:
+        questions_query = [question_to_dict(q) for q in Question.query.filter_by(chapter_id=attempt.chapter_id)]
     else:
-        questions_query = Question.query.filter_by(quiz_id=attempt.quiz_id).all()
+        questions_query = [question_to_dict(q) for q in Question.query.filter_by(quiz_id=attempt.quiz_id)]
 
     # Parse stored answers
     user_answers = {}
@@ -457,27 +1648,27 @@ def answer_key(attempt_id):
     detailed_questions = []
 
     for q in questions_query:
-        selected = user_answers.get(q.id)
+        selected = user_answers.get(q["id"])
 
         if selected is None:
             unattempted += 1
-        elif selected == q.correct_option:
+        elif selected == q["correct_option"]:
             correct += 1
         else:
             wrong += 1
 
         detailed_questions.append({
-            "id": q.id,
-            "question_statement": q.question_statement,
-            "question_image": q.question_image,
-            "options": [q.option_1, q.option_2, q.option_3, q.option_4],
-            "correct_option": q.correct_option,
+            "id": q["id"],
+            "question_statement": q["question_statement"],
+            "question_image": q["question_image"],
+            "options": [q["option_1"], q["option_2"], q["option_3"], q["option_4"]],
+            "correct_option": q["correct_option"],
             "selected": selected,
-            "explanation": q.explanation
+            "explanation": q["explanation"]
         })
 
     # ACCURACY CALCULATION
-    accuracy = round((correct / total) * 100, 2) if total else 0
+    accuracy = accuracy_percent(correct, total)
 
     # PERFORMANCE MESSAGE LOGIC
     if accuracy < 30:
@@ -521,7 +1712,75 @@ def answer_key(attempt_id):
 def user_profile():
     user_id = session['user_id']
     user = User.query.get_or_404(user_id)
-    return render_template('user_profile.html', user=user)
+
+    masteries = UserMastery.query.filter_by(user_id=user_id).options(
+        joinedload(UserMastery.quiz), joinedload(UserMastery.chapter)
+    ).order_by(UserMastery.quiz_id, UserMastery.chapter_id).all()
+    counts = chapter_question_counts([m.chapter_id for m in masteries])
+
+    # Sizes of the packed arrays give the counts without decoding them
+    mastery_rows = []
+    for m in masteries:
+        total = counts.get(m.chapter_id, 0)
+        mastered = min(packed_count(m.seen) - packed_count(m.incorrect), total)
+        mastery_rows.append({
+            "quiz": m.quiz,
+            "chapter": m.chapter,
+            "mastered": mastered,
+            "to_review": packed_count(m.incorrect),
+            "total": total,
+            "percent": accuracy_percent(mastered, total)
+        })
+
+    return render_template('user_profile.html', user=user, mastery_rows=mastery_rows)
+
+# ---------------- PRACTICE MODE ----------------
+@app.route('/practice/<int:quiz_id>/<int:chapter_id>', methods=['GET', 'POST'])
+@login_required
+def practice(quiz_id, chapter_id):
+    quiz = Quiz.query.get_or_404(quiz_id)
+    chapter = Chapter.query.get_or_404(chapter_id)
+    user_id = session['user_id']
+    practice_key = f"practice_{quiz.id}_{chapter.id}"
+    snapshot_key = f"practice_snapshot_{quiz.id}_{chapter.id}"
+
+    if request.method == "POST":
+        # Grade against the paper version the questions were served from, like take_quiz
+        snapshot_id = session.pop(snapshot_key, None)
+        served_ids = session.pop(practice_key, [])
+        by_id = snapshot_question_map(snapshot_id) if snapshot_id else {}
+        served = [by_id[qid] for qid in served_ids if qid in by_id]
+        if not served:
+            return redirect(url_for('practice', quiz_id=quiz.id, chapter_id=chapter.id))
+
+        results = {}
+        for q in served:
+            ans = request.form.get(f'q{q["id"]}')
+            results[q["id"]] = bool(ans) and int(ans) == q["correct_option"]
+        record_mastery(user_id, quiz.id, chapter.id, results, snapshot_id)
+        db.session.commit()
+
+        return render_template(
+            'quiz_result.html',
+            score=sum(results.values()),
+            total=len(served),
+            quiz_id=quiz.id,
+            attempt_id=None,
+            practice_url=url_for('practice', quiz_id=quiz.id, chapter_id=chapter.id)
+        )
+
+    snapshot_id = current_snapshot_id(quiz.id, chapter.id)
+    mastery = UserMastery.query.filter_by(user_id=user_id, chapter_id=chapter.id).first()
+    questions = select_practice_questions(mastery, snapshot_id)
+    db.session.commit()  # keeps candidate lists refreshed for a new paper version
+
+    if not questions:
+        flash('Nothing left to practice in this chapter. Great job!', 'success')
+        return redirect(url_for('user_profile'))
+
+    session[practice_key] = [q["id"] for q in questions]
+    session[snapshot_key] = snapshot_id
+    return render_template('practice_quiz.html', quiz=quiz, chapter=chapter, questions=questions)
 
 # ---------------- ADMIN USERS LIST (SECURE - NO PASSWORD DISPLAY!) ----------------
 @app.route('/admin/users')
@@ -531,11 +1790,16 @@ def admin_users():
     users = User.query.all()
     
     for user in users:
-        attempts = QuizAttempt.query.filter_by(user_id=user.id).order_by(QuizAttempt.timestamp.desc()).all()
+        attempts = QuizAttempt.query.filter_by(user_id=user.id).all()
+        attempts += ArchivedAttempt.query.filter_by(user_id=user.id).all()
+        attempts.sort(key=lambda a: a.timestamp, reverse=True)
         if attempts:
             for attempt in attempts:
                 chapter_title = attempt.chapter.title if attempt.chapter else "N/A"
-                total_questions = len(attempt.chapter.questions) if attempt.chapter else len(attempt.quiz.questions)
+                if attempt.snapshot_id:
+                    total_questions = snapshot_size(attempt.snapshot_id)
+                else:
+                    total_questions = len(attempt.chapter.questions) if attempt.chapter else len(attempt.quiz.questions)
                 score_text = f"{attempt.score}/{total_questions}"
 
                 all_attempts_data.append({
@@ -558,7 +1822,98 @@ def admin_users():
                 "date": "N/A"
             })
     
-    return render_template('admin_users.html', attempts_data=all_attempts_data)
+    quizzes = Quiz.query.order_by(Quiz.title).all()
+    chapters = Chapter.query.options(joinedload(Chapter.quiz)).order_by(Chapter.quiz_id, Chapter.title).all()
+
+    return render_template('admin_users.html', attempts_data=all_attempts_data, quizzes=quizzes, chapters=chapters)
+
+# ---------------- ADMIN IMPORT USERS ----------------
+@app.route('/admin/import/users', methods=['GET', 'POST'])
+@admin_required
+def import_users():
+    if request.method == "POST":
+        file = request.files.get('roster')
+        if not file or file.filename == "":
+            flash('Please choose a CSV file to upload.', 'danger')
+            return render_template('import_users.html')
+
+        try:
+            rows = read_roster(io.TextIOWrapper(file.stream, encoding='utf-8-sig'))
+        except (ValueError, UnicodeDecodeError) as e:
+            flash(f'Invalid roster: {e}', 'danger')
+            return render_template('import_users.html')
+
+        # Hashing a large roster takes a while, so it runs in the background like exports do
+        os.makedirs(IMPORT_FOLDER, exist_ok=True)
+        job_id = f"roster_{datetime.utcnow():%Y%m%d_%H%M%S}_{secrets.token_hex(4)}"
+        open(import_file_path(job_id, partial=True), 'w').close()
+        threading.Thread(target=run_import_job, args=(job_id, rows), daemon=True).start()
+        return redirect(url_for('import_status', job_id=job_id))
+
+    return render_template('import_users.html')
+
+@app.route('/admin/import/<job_id>')
+@admin_required
+def import_status(job_id):
+    job_id = secure_filename(job_id)
+    report = None
+    if os.path.exists(import_file_path(job_id)):
+        with open(import_file_path(job_id), encoding='utf-8') as fh:
+            report = json.load(fh)
+        state = 'ready'
+    elif os.path.exists(import_file_path(job_id, partial=True)):
+        state = 'running'
+    else:
+        state = 'missing'
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(status=state, report=report)
+    return render_template('import_status.html', job_id=job_id, state=state, report=report)
+
+# ---------------- ADMIN EXPORT ATTEMPTS ----------------
+@app.route('/admin/export/attempts')
+@admin_required
+def export_attempts():
+    try:
+        filters = parse_export_filters(request.args)
+    except ValueError:
+        flash('Invalid date format!', 'danger')
+        return redirect(url_for('admin_users'))
+
+    excel = request.args.get('format') == 'excel'
+
+    # Large exports can be written to a file in the background and downloaded later
+    if request.args.get('background'):
+        os.makedirs(EXPORT_FOLDER, exist_ok=True)
+        job_id = f"attempts_{datetime.utcnow():%Y%m%d_%H%M%S}_{secrets.token_hex(4)}"
+        open(export_file_path(job_id, partial=True), 'w').close()
+        threading.Thread(target=run_export_job, args=(job_id, filters, excel), daemon=True).start()
+        return redirect(url_for('export_status', job_id=job_id))
+
+    filename = f"attempts_{datetime.utcnow():%Y%m%d_%H%M%S}.csv"
+    return Response(
+        stream_with_context(export_csv_lines(filters, excel)),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route('/admin/export/<job_id>')
+@admin_required
+def export_status(job_id):
+    job_id = secure_filename(job_id)
+    if os.path.exists(export_file_path(job_id)):
+        if request.args.get('download'):
+            return send_file(export_file_path(job_id), mimetype='text/csv', as_attachment=True,
+                             download_name=f"{job_id}.csv")
+        state = 'ready'
+    elif os.path.exists(export_file_path(job_id, partial=True)):
+        state = 'running'
+    else:
+        state = 'missing'
+
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(status=state)
+    return render_template('export_status.html', job_id=job_id, state=state)
 
 # ---------------- ADD QUIZ ----------------
 @app.route('/add/quiz', methods=['GET', 'POST'])
@@ -650,6 +2005,8 @@ def add_question(quiz_id, chapter_id):
                 explanation=explanation
             )
             db.session.add(new_question)
+            db.session.flush()
+            refresh_snapshots(quiz.id, chapter.id)
             db.session.commit()
             
             flash('Question added successfully!', 'success')
@@ -663,39 +2020,41 @@ def add_question(quiz_id, chapter_id):
 # ---------------- TAKE QUIZ ----------------
 @app.route('/take/quiz/<int:quiz_id>/<int:chapter_id>', methods=['GET', 'POST'])
 @login_required
+@admission_controlled
 def take_quiz(quiz_id, chapter_id):
     quiz = Quiz.query.get_or_404(quiz_id)
     chapter = Chapter.query.get_or_404(chapter_id)
-    questions_query = Question.query.filter_by(chapter_id=chapter.id).all()
 
-    if not questions_query:
+    session_key = f"quiz_end_{quiz.id}_{chapter.id}"
+    snapshot_key = f"quiz_snapshot_{quiz.id}_{chapter.id}"
+
+    # Time spent in the waiting room does not count against a running exam
+    if g.get('admission_wait') and session_key in session:
+        session[session_key] += g.admission_wait
+
+    # A student keeps the paper version they started with, even if an admin edits it mid-exam
+    snapshot_id = session.get(snapshot_key) if session_key in session else None
+    if not snapshot_id:
+        snapshot_id = current_snapshot_id(quiz.id, chapter.id)
+    questions = snapshot_questions(snapshot_id)
+
+    if not questions:
         flash('No questions available in this chapter yet.', 'warning')
         return redirect(url_for('chapter_wise_quiz', quiz_id=quiz_id))
 
-    questions = []
-    for q in questions_query:
-        questions.append({
-            "id": q.id,
-            "question_statement": q.question_statement,
-            "question_image": q.question_image,
-            "option_1": q.option_1,
-            "option_2": q.option_2,
-            "option_3": q.option_3,
-            "option_4": q.option_4,
-            "correct_option": q.correct_option
-        })
-
-    session_key = f"quiz_end_{quiz.id}_{chapter.id}"
     total_seconds = len(questions) * 60
 
     if request.method == "POST":
         score = 0
         user_answers = {}
 
+        results = {}
+
         for q in questions:
             ans = request.form.get(f'q{q["id"]}')
             user_answers[str(q["id"])] = int(ans) if ans else None
-            if ans and int(ans) == q["correct_option"]:
+            results[q["id"]] = bool(ans) and int(ans) == q["correct_option"]
+            if results[q["id"]]:
                 score += 1
 
         new_attempt = QuizAttempt(
@@ -703,11 +2062,18 @@ def take_quiz(quiz_id, chapter_id):
             quiz_id=quiz.id,
             chapter_id=chapter.id,
             score=score,
-            answers=json.dumps(user_answers)
+            answers=json.dumps(user_answers),
+            snapshot_id=snapshot_id
         )
         db.session.add(new_attempt)
+        record_attempt_stats(session['user_id'], quiz.id, chapter.id, score, len(questions))
+        record_mastery(session['user_id'], quiz.id, chapter.id, results, snapshot_id)
         db.session.commit()
         session.pop(session_key, None)
+        session.pop(snapshot_key, None)
+
+        leaderboard_hub.publish((quiz.id, chapter.id), leaderboard_entry(
+            new_attempt.id, session['user_id'], session.get('username'), score, new_attempt.timestamp))
 
         return render_template(
             'quiz_result.html',
@@ -719,15 +2085,31 @@ def take_quiz(quiz_id, chapter_id):
 
     if session_key not in session:
         session[session_key] = int(time.time()) + total_seconds
+        session[snapshot_key] = snapshot_id
 
     return render_template(
         'take_quiz.html',
         quiz=quiz,
         chapter=chapter,
-        questions=questions,
+        question_list=render_question_list(snapshot_id),
         quiz_end_time=session[session_key]
     )
 
+# ---------------- WAITING ROOM ----------------
+@app.route('/waiting-room/status')
+def waiting_room_status():
+    ticket, enqueued_at = read_ticket(request.args.get('ticket'))
+    if not ticket:
+        return jsonify(status='invalid'), 400
+
+    state, position = admission.status(ticket, enqueued_at)
+    return jsonify(status=state, position=position, retry_after=ADMISSION_POLL_SECONDS)
+
+@app.route('/admin/metrics/admission')
+@admin_required
+def admission_metrics():
+    return jsonify(admission.metrics())
+
 # ---------------- USER LOGOUT ----------------
 @app.route('/user/logout')
 def user_logout():
@@ -750,6 +2132,10 @@ def delete_quiz(quiz_id):
 
     # Delete related records (cascading)
     QuizAttempt.query.filter_by(quiz_id=quiz.id).delete()
+    ArchivedAttempt.query.filter_by(quiz_id=quiz.id).delete()
+    UserChapterStats.query.filter_by(quiz_id=quiz.id).delete()
+    UserMastery.query.filter_by(quiz_id=quiz.id).delete()
+    PaperSnapshot.query.filter_by(quiz_id=quiz.id).delete()
     Question.query.filter_by(quiz_id=quiz.id).delete()
     Chapter.query.filter_by(quiz_id=quiz.id).delete()
 
@@ -767,7 +2153,12 @@ def delete_chapter(chapter_id):
     
     # Delete related records
     QuizAttempt.query.filter_by(chapter_id=chapter.id).delete()
+    ArchivedAttempt.query.filter_by(chapter_id=chapter.id).delete()
+    UserChapterStats.query.filter_by(chapter_id=chapter.id).delete()
+    UserMastery.query.filter_by(chapter_id=chapter.id).delete()
+    PaperSnapshot.query.filter_by(chapter_id=chapter.id).delete()
     Question.query.filter_by(chapter_id=chapter.id).delete()
+    refresh_snapshots(chapter.quiz_id)
 
     db.session.delete(chapter)
     db.session.commit()
@@ -782,6 +2173,8 @@ def delete_question(question_id):
     question = Question.query.get_or_404(question_id)
 
     db.session.delete(question)
+    db.session.flush()
+    refresh_snapshots(question.quiz_id, question.chapter_id)
     db.session.commit()
     
     flash('Question deleted successfully!', 'success')
@@ -835,6 +2228,8 @@ def edit_question(question_id):
                 flash('Invalid file type! Only PNG, JPG, JPEG, GIF allowed.', 'danger')
                 return render_template("edit_question.html", question=question)
 
+        db.session.flush()
+        refresh_snapshots(question.quiz_id, question.chapter_id)
         db.session.commit()
         flash('Question updated successfully!', 'success')
         return redirect("/admin/dashboard")
@@ -843,6 +2238,180 @@ def edit_question(question_id):
     return render_template("edit_question.html", question=question)
 
 
+# ========================== CLI COMMANDS ==========================
+@app.cli.command('rebuild-stats')
+def rebuild_stats():
+    """Rebuild UserChapterStats from the full attempt history, archived attempts included"""
+    print(f"✅ Rebuilt stats for {rebuild_chapter_stats()} user/chapter pairs")
+
+@app.cli.command('rebuild-mastery')
+def rebuild_mastery():
+    """Rebuild UserMastery from the answers stored on (non-archived) QuizAttempt rows"""
+    print(f"✅ Rebuilt mastery for {rebuild_mastery_index()} user/chapter pairs")
+
+@app.cli.command('import-users')
+@click.argument('roster', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--workers', type=int, default=None, help='Hashing processes (default: CPU count).')
+def import_users_command(roster, workers):
+    """Create student accounts from a CSV with username,password,fullname,dob columns"""
+    try:
+        rows = read_roster(roster)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    report = import_roster(rows, workers)
+    for line, username, message in report['errors']:
+        print(f"   line {line}: {username or '-'}: {message}")
+    print(f"✅ Created {report['created']}/{report['total']} users in {report['seconds']}s "
+          f"({report['users_per_second']} users/s, hashing {report['hash_seconds']}s)")
+
+@app.cli.command('archive-attempts')
+@click.option('--days', default=ARCHIVE_RETENTION_DAYS, show_default=True, help='Keep attempts newer than this many days.')
+@click.option('--batch-size', default=1000, show_default=True)
+def archive_attempts(days, batch_size):
+    """Move attempts older than the retention window into gzipped JSON-lines files"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    os.makedirs(ARCHIVE_FOLDER, exist_ok=True)
+    archived = 0
+
+    # Work in id-ordered batches so memory stays flat however many rows qualify
+    last_id, skipped = 0, 0
+    while True:
+        batch = QuizAttempt.query.filter(
+            QuizAttempt.timestamp < cutoff, QuizAttempt.id > last_id
+        ).order_by(QuizAttempt.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        # An id that is already archived belongs to a different, older attempt (ids reused
+        # before quiz_attempt had AUTOINCREMENT); leave that row alone rather than clobber it
+        already = {aid for (aid,) in db.session.query(ArchivedAttempt.id).filter(
+            ArchivedAttempt.id.in_([a.id for a in batch]))}
+        fresh = [a for a in batch if a.id not in already]
+        skipped += len(batch) - len(fresh)
+        if not fresh:
+            continue
+
+        # Insert the index rows first; lines are only appended once those inserts succeeded
+        by_file = {}
+        for attempt in fresh:
+            archive_file = archive_file_name(attempt.timestamp)
+            by_file.setdefault(archive_file, []).append(attempt)
+            db.session.add(ArchivedAttempt(
+                id=attempt.id,
+                user_id=attempt.user_id,
+                quiz_id=attempt.quiz_id,
+                chapter_id=attempt.chapter_id,
+                score=attempt.score,
+                snapshot_id=attempt.snapshot_id,
+                timestamp=attempt.timestamp,
+                archive_file=archive_file
+            ))
+        db.session.flush()
+
+        for archive_file, attempts in by_file.items():
+            with gzip.open(os.path.join(ARCHIVE_FOLDER, archive_file), 'at', encoding='utf-8') as fh:
+                for attempt in attempts:
+                    fh.write(json.dumps(attempt_to_record(attempt), separators=(',', ':'), ensure_ascii=False) + '\n')
+
+        QuizAttempt.query.filter(QuizAttempt.id.in_([a.id for a in fresh])).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+        archived += len(fresh)
+
+    if skipped:
+        print(f"⚠️  Skipped {skipped} attempts whose id is already archived")
+    dropped = drop_empty_partitions(cutoff) if db.engine.dialect.name == 'postgresql' else 0
+    print(f"✅ Archived {archived} attempts older than {cutoff:%Y-%m-%d} to {ARCHIVE_FOLDER}"
+          + (f", dropped {dropped} empty partitions" if dropped else ""))
+
+def attempt_partitions():
+    """Names of the monthly quiz_attempt partitions (PostgreSQL only)"""
+    return [name for (name,) in db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'quiz_attempt' AND c.relname LIKE 'quiz\\_attempt\\_y%' ORDER BY c.relname"
+    ))]
+
+def create_attempt_partition(start):
+    end = month_start(start, 1)
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS quiz_attempt_y{start:%Y}m{start:%m} PARTITION OF quiz_attempt "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+def drop_empty_partitions(cutoff):
+    """Drop monthly partitions that end before the cutoff and were emptied by archiving"""
+    dropped = 0
+    for name in attempt_partitions():
+        start = datetime.strptime(name[len('quiz_attempt_'):], 'y%Ym%m')
+        if month_start(start, 1) <= cutoff and not db.session.execute(text(f"SELECT EXISTS (SELECT 1 FROM {name})")).scalar():
+            db.session.execute(text(f"DROP TABLE {name}"))
+            dropped += 1
+    db.session.commit()
+    return dropped
+
+@app.cli.command('partition-attempts')
+@click.option('--months-ahead', default=3, show_default=True, help='Monthly partitions to create in advance.')
+def partition_attempts(months_ahead):
+    """Range-partition quiz_attempt by month on PostgreSQL; SQLite keeps a plain table"""
+    if db.engine.dialect.name != 'postgresql':
+        print(f"ℹ️  Partitioning needs PostgreSQL, keeping quiz_attempt as a plain {db.engine.dialect.name} table")
+        return
+
+    partitioned = db.session.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+        "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'quiz_attempt')"
+    )).scalar()
+    first_month = month_start(datetime.utcnow())
+
+    if not partitioned:
+        # The partition key must be part of the primary key, so the table is rebuilt once
+        oldest = db.session.query(db.func.min(QuizAttempt.timestamp)).scalar()
+        if oldest:
+            first_month = min(first_month, month_start(oldest))
+
+        for statement in (
+            "ALTER TABLE quiz_attempt RENAME TO quiz_attempt_unpartitioned",
+            "ALTER TABLE quiz_attempt_unpartitioned RENAME CONSTRAINT quiz_attempt_pkey TO quiz_attempt_unpartitioned_pkey",
+            "DROP INDEX IF EXISTS ix_quiz_attempt_user_id_id",
+            """CREATE TABLE quiz_attempt (
+                id INTEGER NOT NULL DEFAULT nextval('quiz_attempt_id_seq'),
+                user_id INTEGER NOT NULL REFERENCES "user" (id),
+                quiz_id INTEGER NOT NULL REFERENCES quiz (id),
+                chapter_id INTEGER REFERENCES chapter (id),
+                score INTEGER,
+                answers TEXT,
+                snapshot_id INTEGER REFERENCES paper_snapshot (id),
+                timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)""",
+            "CREATE INDEX ix_quiz_attempt_user_id_id ON quiz_attempt (user_id, id)",
+            "CREATE TABLE quiz_attempt_default PARTITION OF quiz_attempt DEFAULT",
+        ):
+            db.session.execute(text(statement))
+
+        month = first_month
+        while month <= month_start(datetime.utcnow(), months_ahead):
+            create_attempt_partition(month)
+            month = month_start(month, 1)
+
+        db.session.execute(text(
+            "INSERT INTO quiz_attempt (id, user_id, quiz_id, chapter_id, score, answers, snapshot_id, timestamp) "
+            "SELECT id, user_id, quiz_id, chapter_id, score, answers, snapshot_id, "
+            "COALESCE(timestamp, now() AT TIME ZONE 'utc') FROM quiz_attempt_unpartitioned"
+        ))
+        db.session.execute(text("ALTER SEQUENCE quiz_attempt_id_seq OWNED BY quiz_attempt.id"))
+        db.session.execute(text("DROP TABLE quiz_attempt_unpartitioned"))
+    else:
+        for month_offset in range(months_ahead + 1):
+            create_attempt_partition(month_start(datetime.utcnow(), month_offset))
+
+    db.session.commit()
+    print(f"✅ quiz_attempt partitions: {', '.join(attempt_partitions())}")
+
+
 #---------------- MAIN ----------------
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,84 @@
+# =============== TEMPLATE RENDER BENCHMARK ===================
+# Usage: python benchmarks/bench_templates.py [num_questions] [iterations]
+#
+# Compares rendering take_quiz.html with the question list re-rendered on every
+# hit (old behaviour) against the cached per-snapshot fragment, and cold template
+# compilation with and without the Jinja bytecode cache.
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from flask import render_template
+from app import app, db, Quiz, Chapter, Question, current_snapshot_id, render_question_list
+
+NUM_QUESTIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+ITERATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+
+def timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def cold_compile(bytecode_cache):
+    env = Environment(loader=FileSystemLoader(app.template_folder), bytecode_cache=bytecode_cache)
+    env.globals['url_for'] = lambda *args, **kwargs: ''
+    for name in ('take_quiz.html', 'take_quiz_questions.html', 'chapter_wise_quiz.html',
+                 'leaderboard.html', 'quiz_analysis.html'):
+        env.get_template(name)
+
+
+def main():
+    with app.app_context():
+        db.create_all()
+        quiz = Quiz(title='Benchmark')
+        db.session.add(quiz)
+        db.session.flush()
+        chapter = Chapter(title='Benchmark', quiz_id=quiz.id)
+        db.session.add(chapter)
+        db.session.flush()
+        for i in range(NUM_QUESTIONS):
+            db.session.add(Question(
+                quiz_id=quiz.id, chapter_id=chapter.id,
+                question_statement=f'Benchmark question {i}?',
+                option_1='Alpha', option_2='Beta', option_3='Gamma', option_4='Delta',
+                correct_option=1
+            ))
+        db.session.commit()
+        snapshot_id = current_snapshot_id(quiz.id, chapter.id)
+
+        with app.test_request_context():
+            def render_page(question_list):
+                return render_template('take_quiz.html', quiz=quiz, chapter=chapter,
+                                       question_list=question_list, quiz_end_time=int(time.time()))
+
+            uncached = timed(lambda: render_page(render_question_list.__wrapped__(snapshot_id)), ITERATIONS)
+            render_question_list(snapshot_id)
+            cached = timed(lambda: render_page(render_question_list(snapshot_id)), ITERATIONS)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        no_cache = timed(lambda: cold_compile(None), 20)
+        cold_compile(bytecode_cache)
+        with_cache = timed(lambda: cold_compile(bytecode_cache), 20)
+
+    print(f"take_quiz.html ({NUM_QUESTIONS} questions, {ITERATIONS} renders)")
+    print(f"   re-rendered question list : {uncached:8.3f} ms/render")
+    print(f"   cached question fragment  : {cached:8.3f} ms/render  ({uncached / cached:.1f}x)")
+    print("cold template load (5 quiz templates)")
+    print(f"   compile from source       : {no_cache:8.3f} ms")
+    print(f"   bytecode cache            : {with_cache:8.3f} ms  ({no_cache / with_cache:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()